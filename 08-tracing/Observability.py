@@ -3,17 +3,10 @@
 
 import asyncio
 import os
-from random import randint
-from typing import Annotated
 
 import dotenv
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
-from azure.monitor.opentelemetry import configure_azure_monitor
-from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
 from opentelemetry import trace
 from opentelemetry.trace.span import format_trace_id
-from pydantic import Field
 
 """
 This sample shows you can can setup telemetry for an Azure AI agent.
@@ -35,68 +28,127 @@ os.environ["OTEL_INSTRUMENTATION_GENAI_CAPTURE_MESSAGE_CONTENT"] = "true"
 if "OPENAI_API_VERSION" not in os.environ:
     os.environ["OPENAI_API_VERSION"] = "2024-08-01-preview"
 
+# Tune the BatchSpanProcessor created by configure_azure_monitor: export
+# more often, keep a larger queue and don't block shutdown for 30 seconds
+os.environ.setdefault("OTEL_BSP_MAX_QUEUE_SIZE", "4096")
+os.environ.setdefault("OTEL_BSP_SCHEDULE_DELAY", "1000")
+os.environ.setdefault("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "256")
+os.environ.setdefault("OTEL_BSP_EXPORT_TIMEOUT", "10000")
 
-async def get_weather(location: str) -> str:
-    """Get the weather for a given location."""
-    await asyncio.sleep(randint(0, 10) / 10.0)  # Simulate a network call
-    conditions = ["sunny", "cloudy", "rainy", "stormy"]
-    return f"The weather in {location} is {conditions[randint(0, 3)]} with a high of {randint(10, 30)}°C."
+# Every question is traced by default. To record only a fraction of traces
+# (e.g. one in ten), set OTEL_TRACES_SAMPLER=parentbased_traceidratio and
+# OTEL_TRACES_SAMPLER_ARG=0.1.
+_RATIO_SAMPLERS = ("traceidratio", "parentbased_traceidratio")
 
+# Scope used for bearer tokens sent to Azure OpenAI
+_OPENAI_TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
 
-def main():
-    # Step 1: Create AIProjectClient and get connection string
-    project_client = AIProjectClient(
-        credential=DefaultAzureCredential(),
-        endpoint=os.environ["AZURE_AI_PROJECT_ENDPOINT"],
-    )
-    connection_string = project_client.telemetry.get_application_insights_connection_string()
-    
-    # Step 2: Configure Azure Monitor and instrument OpenAI SDK
-    configure_azure_monitor(connection_string=connection_string)
-    OpenAIInstrumentor().instrument()
-    
-    # Step 3: Get OpenAI client
-    client = project_client.get_openai_client()
-    
-    # Step 4: Example with weather questions using custom spans
-    tracer = trace.get_tracer(__name__)
+# Cap string span attributes before configure_azure_monitor sets up the SDK
+from span_limits import truncate_attribute
+
+
+def _sampling_ratio() -> float:
+    """Get the Azure Monitor sampling ratio from the standard OTEL sampler settings."""
+    if os.environ.get("OTEL_TRACES_SAMPLER") not in _RATIO_SAMPLERS:
+        return 1.0
+    try:
+        return float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", "1.0"))
+    except ValueError:
+        return 1.0
+
+
+async def ask_weather_question(client, tracer, question: str) -> tuple[str, str]:
+    """Ask a single weather question inside its own span and return (trace_id, response_text)."""
+    with tracer.start_as_current_span(f"Weather Question: {question[:30]}...") as span:
+        span_context = span.get_span_context()
+        trace_id = format_trace_id(span_context.trace_id)
+        if not span_context.trace_flags.sampled:
+            trace_id += " (not sampled, nothing exported)"
+        # Collected as they become known and set on the span in one call
+        span_attributes = {
+            "operation.type": "weather_inquiry",
+            "user.question": truncate_attribute(question),
+        }
+        
+        # Create a system message that includes the weather function
+        messages = [
+            {
+                "role": "system", 
+                "content": "You are a helpful weather assistant. When asked about weather, provide a realistic weather forecast for the requested location."
+            },
+            {"role": "user", "content": question}
+        ]
+        
+        # Not streamed: answers are printed after all questions finish, and a
+        # full response carries the token usage the OpenAI instrumentor records
+        response = await client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+        )
+        
+        response_text = response.choices[0].message.content
+        span_attributes["assistant.response"] = truncate_attribute(response_text)
+        span_attributes["response.length"] = len(response_text)
+        if span.is_recording():
+            span.set_attributes(span_attributes)
+        
+        return trace_id, response_text
+
+
+async def main():
+    # Heavy SDK and telemetry packages are imported only when the sample runs
+    from azure.ai.projects.aio import AIProjectClient
+    from azure.identity.aio import DefaultAzureCredential
+    from azure.monitor.opentelemetry import configure_azure_monitor
+    from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
     
-    questions = [
-        "What's the weather in Amsterdam?",
-        "What's the weather in Tokyo?",
-        "What's the weather in New York?"
-    ]
+    # One credential for the whole run. Excluding the shared token cache only
+    # drops the cache of sign-ins made from tools like Visual Studio; the
+    # managed identity (IMDS) probe still runs first when not on Azure.
+    credential = DefaultAzureCredential(exclude_shared_token_cache_credential=True)
     
-    for question in questions:
-        with tracer.start_as_current_span(f"Weather Question: {question[:30]}...") as span:
-            print(f"Trace ID: {format_trace_id(span.get_span_context().trace_id)}")
-            span.set_attribute("operation.type", "weather_inquiry")
-            span.set_attribute("user.question", question)
+    async with (
+        credential,
+        AIProjectClient(
+            credential=credential,
+            endpoint=os.environ["AZURE_AI_PROJECT_ENDPOINT"],
+        ) as project_client,
+    ):
+        # Acquire a token up front so the concurrent requests below all find it cached
+        await credential.get_token(_OPENAI_TOKEN_SCOPE)
+        
+        # Step 1: Get the Application Insights connection string
+        connection_string = await project_client.telemetry.get_application_insights_connection_string()
+        
+        # Step 2: Configure Azure Monitor and instrument OpenAI SDK
+        configure_azure_monitor(
+            connection_string=connection_string,
+            sampling_ratio=_sampling_ratio(),
+        )
+        OpenAIInstrumentor().instrument()
+        
+        # Step 3: Get a single async OpenAI client so all questions share one connection pool
+        async with await project_client.get_openai_client() as client:
+            # Step 4: Example with weather questions using custom spans
+            tracer = trace.get_tracer(__name__)
             
-            # Create a system message that includes the weather function
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "You are a helpful weather assistant. When asked about weather, provide a realistic weather forecast for the requested location."
-                },
-                {"role": "user", "content": question}
+            questions = [
+                "What's the weather in Amsterdam?",
+                "What's the weather in Tokyo?",
+                "What's the weather in New York?"
             ]
             
-            print(f"User: {question}")
-            print(f"Assistant: ", end="")
-            
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
+            # The questions are independent, so issue them concurrently
+            results = await asyncio.gather(
+                *(ask_weather_question(client, tracer, question) for question in questions)
             )
-            
-            response_text = response.choices[0].message.content
-            span.set_attribute("assistant.response", response_text)
-            span.set_attribute("response.length", len(response_text))
-            
-            print(response_text)
-            print("-" * 80)
+    
+    for question, (trace_id, response_text) in zip(questions, results):
+        print(f"Trace ID: {trace_id}")
+        print(f"User: {question}")
+        print(f"Assistant: {response_text}")
+        print("-" * 80)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
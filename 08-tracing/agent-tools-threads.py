@@ -6,21 +6,62 @@ This example demonstrates how to create AI agents with custom tools and manage
 conversation threads, similar to the Azure OpenAI Assistants API pattern.
 """
 
+import ast
 import asyncio
+import functools
+import hashlib
 import os
-from typing import Any, Dict, List
+import re
+from collections import OrderedDict
+from contextlib import nullcontext
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import orjson
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Import Azure OpenAI client
-from azure.identity import DefaultAzureCredential
-from openai import AzureOpenAI
+# Compress spans sent to the OTLP collector configured by setup_observability
+os.environ.setdefault("OTEL_EXPORTER_OTLP_COMPRESSION", "gzip")
+
+# Every run is traced by default. To record only a fraction of runs (e.g. one
+# in ten), set OTEL_TRACES_SAMPLER=parentbased_traceidratio and
+# OTEL_TRACES_SAMPLER_ARG=0.1; unsampled runs then skip their child spans.
+
+# Cap string span attributes before setup_observability configures the SDK
+from span_limits import truncate_attribute
+
+# Import the lightweight tracing API; the SDK is set up by setup_observability
+from opentelemetry import trace
+
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
 
-# Import agent framework for tracing
-from agent_framework import Executor, WorkflowBuilder, WorkflowContext, handler
-from agent_framework.observability import setup_observability
+# Tool detection lookups, built once instead of on every message
+_MATH_RE = re.compile(r'[\d+\-*/().\s]+')
+# Keywords match as word prefixes, so "raining" and "temperatures" count too
+_WEATHER_KW = ("weather", "temperature", "rain", "sunny", "cloudy")
+_CALC_KW = ("calculate", "compute", "math")
+_CALC_OPS = frozenset("+-*/=")
+_LOCATION_PREPOSITIONS = frozenset({"in", "for", "at"})
+
+
+# Mock weather data - in real implementation, you'd call a weather API
+_WEATHER = {
+    "Amsterdam": "cloudy with a high of 15°C",
+    "New York": "sunny with a high of 22°C", 
+    "London": "rainy with a high of 12°C",
+    "Tokyo": "partly cloudy with a high of 18°C",
+    "Sydney": "sunny with a high of 25°C"
+}
+
+# Prebuilt replies keyed by case-folded location, so a known city is a single lookup
+_WEATHER_SENTENCES = {
+    location.casefold(): f"The weather in {location} is {weather}."
+    for location, weather in _WEATHER.items()
+}
 
 
 # Define custom tools for the agent
@@ -30,32 +71,46 @@ class WeatherTool:
     @staticmethod
     def get_weather(location: str) -> str:
         """Get the weather for a given location"""
-        # Mock weather data - in real implementation, you'd call a weather API
-        weather_data = {
-            "Amsterdam": "cloudy with a high of 15°C",
-            "New York": "sunny with a high of 22°C", 
-            "London": "rainy with a high of 12°C",
-            "Tokyo": "partly cloudy with a high of 18°C",
-            "Sydney": "sunny with a high of 25°C"
-        }
-        
-        weather = weather_data.get(location, f"partly cloudy with a high of 20°C")
-        return f"The weather in {location} is {weather}."
+        sentence = _WEATHER_SENTENCES.get(location.casefold())
+        if sentence is None:
+            sentence = f"The weather in {location} is partly cloudy with a high of 20°C."
+        return sentence
+
+
+# Syntax allowed in calculator expressions: numbers and basic arithmetic only
+_CALC_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.UAdd, ast.USub,
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_expression(expression: str):
+    """Validate an arithmetic expression and compile it once per distinct string"""
+    tree = ast.parse(expression, mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _CALC_NODES) or (
+            isinstance(node, ast.Constant) and not isinstance(node.value, (int, float))
+        ):
+            raise ValueError(f"unsupported syntax '{type(node).__name__}'")
+    return compile(tree, "<calc>", "eval")
 
 
 class CalculatorTool:
     """A simple calculator tool for basic math operations"""
     
+    # Only allow numbers, operators, and parentheses
+    allowed_chars = frozenset('0123456789+-*/()., ')
+    
     @staticmethod
     def calculate(expression: str) -> str:
         """Safely evaluate a mathematical expression"""
         try:
-            # Basic safety check - only allow numbers, operators, and parentheses
-            allowed_chars = set('0123456789+-*/()., ')
-            if not all(c in allowed_chars for c in expression):
+            # Basic safety check
+            if not CalculatorTool.allowed_chars.issuperset(expression):
                 return "Error: Invalid characters in expression"
             
-            result = eval(expression)
+            result = eval(_compile_expression(expression), {"__builtins__": {}}, {})
             return f"The result of {expression} is {result}"
         except Exception as e:
             return f"Error calculating {expression}: {str(e)}"
@@ -64,12 +119,45 @@ class CalculatorTool:
 class AgentWithTools:
     """AI Agent that can use tools and manage conversation threads"""
     
-    def __init__(self):
+    # Number of most recent messages sent with each request (besides the system prompt)
+    MAX_CONTEXT_MESSAGES = 20
+    
+    # System prompt shared by all threads; the mapping proxy keeps it read-only
+    _SYSTEM_MSG = MappingProxyType({
+        "role": "system",
+        "content": """You are a helpful assistant with access to weather and calculator tools.
+                
+Available tools:
+- get_weather(location): Get weather information for a location
+- calculate(expression): Perform mathematical calculations
+
+When a user asks about weather, use the get_weather tool.
+When a user asks for calculations, use the calculate tool.
+Always be helpful and provide clear responses."""
+    })
+    
+    def __init__(self, response_cache_size: int = 0, temperature: float = 0.7):
+        # Import the HTTP and Azure OpenAI clients only when an agent is created
+        import httpx
+        from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+        
+        # The SDK's default client (redirects, timeouts) with idle connections kept
+        # for a minute instead of httpx's 5 seconds, so pauses between turns in
+        # the interactive demo don't force a new TCP/TLS handshake
+        self.http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=1000,
+                max_keepalive_connections=100,
+                keepalive_expiry=60,
+            ),
+        )
+        
         # Initialize Azure OpenAI client
-        self.client = AzureOpenAI(
+        self.client: "AsyncAzureOpenAI" = AsyncAzureOpenAI(
             azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version="2024-02-15-preview"
+            api_version="2024-02-15-preview",
+            http_client=self.http_client
         )
         
         # Available tools
@@ -78,31 +166,45 @@ class AgentWithTools:
             "calculate": CalculatorTool.calculate
         }
         
+        # Name of the single argument each tool takes
+        self.tool_parameters = {
+            "get_weather": "location",
+            "calculate": "expression"
+        }
+        
         # Conversation threads storage
         self.threads: Dict[str, List[Dict[str, Any]]] = {}
         
         # Agent configuration
         self.model_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME", "gpt-4o")
+        self.temperature = temperature
+        
+        # Opt-in LRU cache of replies keyed by (model, hash of messages). It is
+        # only used with temperature 0, where identical requests give identical replies.
+        self.response_cache_size = response_cache_size
+        self.response_cache: OrderedDict[tuple[str, bytes], str] = OrderedDict()
+        
+        # Tracer is looked up once and reused for every run
+        self.tracer = trace.get_tracer(__name__)
+    
+    async def __aenter__(self) -> "AgentWithTools":
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+    
+    async def close(self):
+        """Close the OpenAI client and its connection pool"""
+        # Closing the OpenAI client also closes the httpx client it was given
+        await self.client.close()
     
     def create_thread(self, thread_id: str = None) -> str:
         """Create a new conversation thread"""
         if thread_id is None:
             thread_id = f"thread_{len(self.threads) + 1}"
         
-        self.threads[thread_id] = [
-            {
-                "role": "system",
-                "content": """You are a helpful assistant with access to weather and calculator tools.
-                
-Available tools:
-- get_weather(location): Get weather information for a location
-- calculate(expression): Perform mathematical calculations
-
-When a user asks about weather, use the get_weather tool.
-When a user asks for calculations, use the calculate tool.
-Always be helpful and provide clear responses."""
-            }
-        ]
+        # Every thread starts with the same read-only system message object
+        self.threads[thread_id] = [AgentWithTools._SYSTEM_MSG]
         
         print(f"✅ Created thread: {thread_id}")
         return thread_id
@@ -111,6 +213,27 @@ Always be helpful and provide clear responses."""
         """Get all messages in a thread"""
         return self.threads.get(thread_id, [])
     
+    def get_context_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Get the messages to send for a thread: the system prompt plus the latest turns"""
+        messages = self.threads[thread_id]
+        if len(messages) <= self.MAX_CONTEXT_MESSAGES + 1:
+            return messages
+        
+        # A tool message is only valid after the assistant message that called it,
+        # so widen the window to take in that call rather than start on its result
+        start = len(messages) - self.MAX_CONTEXT_MESSAGES
+        while messages[start]["role"] == "tool":
+            start -= 1
+        return [messages[0]] + messages[start:]
+    
+    def response_cache_key(self, messages: List[Dict[str, Any]]) -> Optional[tuple[str, bytes]]:
+        """Get the response cache key for a request, or None when caching does not apply"""
+        if not self.response_cache_size or self.temperature != 0:
+            return None
+        # default=dict lets orjson encode the shared read-only system message
+        digest = hashlib.blake2b(orjson.dumps(messages, default=dict), digest_size=16).digest()
+        return self.model_deployment, digest
+    
     def add_message_to_thread(self, thread_id: str, role: str, content: str):
         """Add a message to a thread"""
         if thread_id not in self.threads:
@@ -121,94 +244,164 @@ Always be helpful and provide clear responses."""
             "content": content
         })
     
+    def add_tool_result_to_thread(self, thread_id: str, tool_name: str, tool_param: str, tool_result: str):
+        """Add a tool call and its result to a thread as an assistant tool call plus a tool message"""
+        call_id = f"call_{len(self.threads[thread_id])}"
+        arguments = orjson.dumps({self.tool_parameters[tool_name]: tool_param}).decode()
+        
+        self.threads[thread_id].append({
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": call_id,
+                "type": "function",
+                "function": {"name": tool_name, "arguments": arguments}
+            }]
+        })
+        self.threads[thread_id].append({
+            "role": "tool",
+            "tool_call_id": call_id,
+            "content": tool_result
+        })
+    
     def detect_tool_usage(self, message: str) -> tuple[str, str]:
         """Simple tool detection based on message content"""
-        message_lower = message.lower()
+        # Tokenize once and reuse the tokens for every keyword check
+        words = message.split()
+        tokens = {word.lower().strip(".,!?") for word in words}
         
         # Weather detection
-        weather_keywords = ["weather", "temperature", "rain", "sunny", "cloudy"]
-        if any(keyword in message_lower for keyword in weather_keywords):
+        if any(token.startswith(_WEATHER_KW) for token in tokens):
             # Extract location (simple approach)
-            words = message.split()
             for i, word in enumerate(words):
-                if word.lower() in ["in", "for", "at"] and i + 1 < len(words):
+                if word.lower() in _LOCATION_PREPOSITIONS and i + 1 < len(words):
                     location = words[i + 1].strip(".,!?")
                     return "get_weather", location
         
         # Calculator detection
-        calc_keywords = ["calculate", "compute", "math", "+", "-", "*", "/", "="]
-        if any(keyword in message_lower for keyword in calc_keywords):
+        if any(token.startswith(_CALC_KW) for token in tokens) or not _CALC_OPS.isdisjoint(message):
             # Extract mathematical expression
-            import re
-            math_pattern = r'[\d\+\-\*/\(\)\.\s]+'
-            matches = re.findall(math_pattern, message)
+            matches = _MATH_RE.findall(message)
             if matches:
                 expression = max(matches, key=len).strip()
                 return "calculate", expression
         
         return None, None
     
-    async def run_with_thread(self, message: str, thread_id: str) -> str:
-        """Run the agent with a message in a specific thread"""
-        from opentelemetry import trace
+    def run_tool_for_message(self, message: str) -> tuple[str, str, str]:
+        """Detect and run the tool a message needs, returning (tool_name, tool_param, tool_result)"""
+        tool_name, tool_param = self.detect_tool_usage(message)
+        if not tool_name or tool_name not in self.tools:
+            return None, None, None
         
-        tracer = trace.get_tracer(__name__)
+        with self.start_child_span(trace.get_current_span(), "tool_execution") as tool_span:
+            # The tools are fast pure functions, so they run inline
+            tool_result = self.tools[tool_name](tool_param)
+            
+            if tool_span.is_recording():
+                tool_span.set_attributes({
+                    "tool.name": tool_name,
+                    "tool.parameter": tool_param,
+                    "tool.result": truncate_attribute(tool_result),
+                })
         
-        with tracer.start_as_current_span("agent_run_with_thread") as span:
-            span.set_attribute("thread_id", thread_id)
-            span.set_attribute("user_message", message)
-            span.set_attribute("agent.model", self.model_deployment)
+        return tool_name, tool_param, tool_result
+    
+    async def stream_completion(self, messages: List[Dict[str, Any]]) -> str:
+        """Stream a chat completion to stdout and return the full reply"""
+        stream = await self.client.chat.completions.create(
+            model=self.model_deployment,
+            messages=messages,
+            max_tokens=500,
+            temperature=self.temperature,
+            stream=True
+        )
+        
+        # Print tokens as they arrive and join them once at the end
+        print("🤖 Assistant: ", end="", flush=True)
+        response_parts: List[str] = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                response_parts.append(delta)
+                print(delta, end="", flush=True)
+        print()
+        return "".join(response_parts)
+    
+    def start_child_span(self, parent: trace.Span, name: str):
+        """Start a child span, or reuse the parent when its trace was not sampled"""
+        if parent.get_span_context().trace_flags.sampled:
+            return self.tracer.start_as_current_span(name)
+        return nullcontext(parent)
+    
+    async def run_with_thread(self, message: str, thread_id: str) -> str:
+        """Run the agent with a message in a specific thread, streaming the reply to stdout"""
+        with self.tracer.start_as_current_span("agent_run_with_thread") as span:
+            # Collected as they become known and set on the span in one call
+            span_attributes = {
+                "thread_id": thread_id,
+                "user_message": truncate_attribute(message),
+                "agent.model": self.model_deployment,
+            }
             
             try:
                 # Add user message to thread
                 self.add_message_to_thread(thread_id, "user", message)
                 
-                # Detect if tools are needed
-                tool_name, tool_param = self.detect_tool_usage(message)
+                # Detect if tools are needed and execute them
+                tool_name, tool_param, tool_result = self.run_tool_for_message(message)
                 
-                if tool_name and tool_name in self.tools:
-                    with tracer.start_as_current_span("tool_execution") as tool_span:
-                        tool_span.set_attribute("tool.name", tool_name)
-                        tool_span.set_attribute("tool.parameter", tool_param)
-                        
-                        # Execute the tool
-                        tool_result = self.tools[tool_name](tool_param)
-                        tool_span.set_attribute("tool.result", tool_result)
-                        
-                        print(f"🔧 Used tool: {tool_name}({tool_param})")
-                        print(f"📊 Tool result: {tool_result}")
-                        
-                        # Add tool result to context
-                        enhanced_message = f"{message}\n\nTool result: {tool_result}\n\nPlease provide a helpful response based on this information."
-                        self.threads[thread_id][-1]["content"] = enhanced_message
+                if tool_name:
+                    print(f"🔧 Used tool: {tool_name}({tool_param})")
+                    print(f"📊 Tool result: {tool_result}")
+                    
+                    # Add tool result to context, leaving the user message untouched
+                    self.add_tool_result_to_thread(thread_id, tool_name, tool_param, tool_result)
                 
                 # Get AI response
-                with tracer.start_as_current_span("ai_completion") as ai_span:
-                    ai_span.set_attribute("messages_count", len(self.threads[thread_id]))
+                with self.start_child_span(span, "ai_completion") as ai_span:
+                    context_messages = self.get_context_messages(thread_id)
                     
-                    response = self.client.chat.completions.create(
-                        model=self.model_deployment,
-                        messages=self.threads[thread_id],
-                        max_tokens=500,
-                        temperature=0.7
-                    )
+                    # Identical requests are answered from the cache when it is enabled
+                    cache_key = self.response_cache_key(context_messages)
+                    ai_response = self.response_cache.get(cache_key) if cache_key else None
+                    response_cached = ai_response is not None
                     
-                    ai_response = response.choices[0].message.content
-                    ai_span.set_attribute("response_tokens", len(ai_response.split()))
+                    if response_cached:
+                        self.response_cache.move_to_end(cache_key)
+                        print(f"🤖 Assistant: {ai_response}")
+                    else:
+                        ai_response = await self.stream_completion(context_messages)
+                        if cache_key:
+                            self.response_cache[cache_key] = ai_response
+                            if len(self.response_cache) > self.response_cache_size:
+                                self.response_cache.popitem(last=False)
                     
-                    # Add AI response to thread
+                    # Add AI response to thread once the stream has completed
                     self.add_message_to_thread(thread_id, "assistant", ai_response)
                     
-                    span.set_attribute("response_length", len(ai_response))
-                    span.set_attribute("tools_used", tool_name is not None)
+                    if ai_span.is_recording():
+                        ai_span.set_attributes({
+                            "messages_count": len(context_messages),
+                            "response_tokens": len(ai_response.split()),
+                            "response_cached": response_cached,
+                        })
+                    
+                    span_attributes["response_length"] = len(ai_response)
+                    span_attributes["tools_used"] = tool_name is not None
                     
                     return ai_response
             
             except Exception as e:
-                span.set_attribute("error", str(e))
+                span_attributes["error"] = str(e)
                 error_message = f"Error processing message: {str(e)}"
+                print(f"❌ {error_message}")
                 self.add_message_to_thread(thread_id, "assistant", error_message)
                 return error_message
+            
+            finally:
+                if span.is_recording():
+                    span.set_attributes(span_attributes)
 
 
 async def demo_agent_with_tools():
@@ -218,6 +411,9 @@ async def demo_agent_with_tools():
     
     # Setup tracing
     try:
+        # Import agent framework for tracing
+        from agent_framework.observability import setup_observability
+        
         setup_observability(
             otlp_endpoint="http://localhost:4317",
             enable_sensitive_data=True
@@ -227,42 +423,43 @@ async def demo_agent_with_tools():
         print(f"⚠️  Tracing setup failed: {e}")
     
     # Create agent
-    agent = AgentWithTools()
-    
-    # Create a conversation thread
-    thread_id = agent.create_thread("weather_demo")
+    async with AgentWithTools() as agent:
+        # Create a conversation thread
+        thread_id = agent.create_thread("weather_demo")
     
-    # Demo conversations
-    demo_messages = [
-        "What's the weather in Amsterdam?",
-        "Is it likely to rain in London?", 
-        "Can you calculate 15 * 8 + 12?",
-        "What about the weather in Tokyo?",
-        "Please compute (100 - 25) / 5"
-    ]
+        # Demo conversations
+        demo_messages = [
+            "What's the weather in Amsterdam?",
+            "Is it likely to rain in London?", 
+            "Can you calculate 15 * 8 + 12?",
+            "What about the weather in Tokyo?",
+            "Please compute (100 - 25) / 5"
+        ]
     
-    print(f"\n🎯 Starting conversation in thread: {thread_id}")
-    print("-" * 40)
+        print(f"\n🎯 Starting conversation in thread: {thread_id}")
+        print("-" * 40)
     
-    for i, message in enumerate(demo_messages, 1):
-        print(f"\n💬 User ({i}): {message}")
-        
-        response = await agent.run_with_thread(message, thread_id)
-        print(f"🤖 Assistant: {response}")
+        for i, message in enumerate(demo_messages, 1):
+            print(f"\n💬 User ({i}): {message}")
         
-        # Small delay for better readability
-        await asyncio.sleep(1)
+            await agent.run_with_thread(message, thread_id)
     
-    # Show thread history
-    print(f"\n📜 Thread History for {thread_id}:")
-    print("-" * 40)
-    messages = agent.get_thread_messages(thread_id)
-    for i, msg in enumerate(messages[1:], 1):  # Skip system message
-        role_emoji = "💬" if msg["role"] == "user" else "🤖"
-        print(f"{role_emoji} {msg['role'].title()}: {msg['content'][:100]}...")
+        # Show thread history
+        print(f"\n📜 Thread History for {thread_id}:")
+        print("-" * 40)
+        messages = agent.get_thread_messages(thread_id)
+        role_emojis = {"user": "💬", "tool": "📊"}
+        for i, msg in enumerate(messages[1:], 1):  # Skip system message
+            if msg.get("tool_calls"):
+                # Assistant tool calls have no text, so show the call instead
+                function = msg["tool_calls"][0]["function"]
+                print(f"🔧 Tool call: {function['name']}({function['arguments']})")
+                continue
+            role_emoji = role_emojis.get(msg["role"], "🤖")
+            print(f"{role_emoji} {msg['role'].title()}: {msg['content'][:100]}...")
     
-    print(f"\n📊 Total messages in thread: {len(messages) - 1}")  # Exclude system message
-    print("🎉 Demo completed! Check AI Foundry portal for traces.")
+        print(f"\n📊 Total messages in thread: {len(messages) - 1}")  # Exclude system message
+        print("🎉 Demo completed! Check AI Foundry portal for traces.")
 
 
 # Interactive demo function
@@ -272,22 +469,21 @@ async def interactive_demo():
     print("=" * 30)
     print("Type 'quit' to exit, 'new_thread' to start a new conversation")
     
-    agent = AgentWithTools()
-    current_thread = agent.create_thread("interactive")
-    
-    while True:
-        user_input = input(f"\n💬 You (thread: {current_thread}): ").strip()
-        
-        if user_input.lower() == 'quit':
-            break
-        elif user_input.lower() == 'new_thread':
-            current_thread = agent.create_thread()
-            continue
-        elif user_input == '':
-            continue
+    async with AgentWithTools() as agent:
+        current_thread = agent.create_thread("interactive")
         
-        response = await agent.run_with_thread(user_input, current_thread)
-        print(f"🤖 Assistant: {response}")
+        while True:
+            user_input = input(f"\n💬 You (thread: {current_thread}): ").strip()
+            
+            if user_input.lower() == 'quit':
+                break
+            elif user_input.lower() == 'new_thread':
+                current_thread = agent.create_thread()
+                continue
+            elif user_input == '':
+                continue
+            
+            await agent.run_with_thread(user_input, current_thread)
     
     print("👋 Goodbye!")
 
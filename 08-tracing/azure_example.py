@@ -4,10 +4,6 @@
 
 import os
 import dotenv
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
-from azure.monitor.opentelemetry import configure_azure_monitor
-from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
 from opentelemetry import trace
 from opentelemetry.trace.span import format_trace_id
 
@@ -21,10 +17,35 @@ os.environ["OTEL_INSTRUMENTATION_GENAI_CAPTURE_MESSAGE_CONTENT"] = "true"
 if "OPENAI_API_VERSION" not in os.environ:
     os.environ["OPENAI_API_VERSION"] = "2024-08-01-preview"
 
+# Tune the BatchSpanProcessor created by configure_azure_monitor: export
+# more often, keep a larger queue and don't block shutdown for 30 seconds
+os.environ.setdefault("OTEL_BSP_MAX_QUEUE_SIZE", "4096")
+os.environ.setdefault("OTEL_BSP_SCHEDULE_DELAY", "1000")
+os.environ.setdefault("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "256")
+os.environ.setdefault("OTEL_BSP_EXPORT_TIMEOUT", "10000")
+
+# Scope used for bearer tokens sent to Azure OpenAI
+_OPENAI_TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+
 def main():
+    # Heavy SDK and telemetry packages are imported only when the sample runs
+    from azure.ai.projects import AIProjectClient
+    from azure.identity import DefaultAzureCredential
+    from azure.monitor.opentelemetry import configure_azure_monitor
+    from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
+    
+    # One credential for the whole run. The interactive browser credential is
+    # already off by default. Excluding the shared token cache only drops the
+    # cache of sign-ins made from tools like Visual Studio; the managed
+    # identity (IMDS) probe still runs first when not on Azure.
+    credential = DefaultAzureCredential(exclude_shared_token_cache_credential=True)
+    
+    # Acquire a token once up front; later requests reuse the cached token
+    credential.get_token(_OPENAI_TOKEN_SCOPE)
+    
     # Step 1: Create AIProjectClient and get connection string
     project_client = AIProjectClient(
-        credential=DefaultAzureCredential(),
+        credential=credential,
         endpoint=os.environ["AZURE_AI_PROJECT_ENDPOINT"],
     )
     connection_string = project_client.telemetry.get_application_insights_connection_string()
@@ -47,15 +68,20 @@ def main():
     
     with tracer.start_as_current_span("custom_weather_question") as span:
         print(f"Trace ID: {format_trace_id(span.get_span_context().trace_id)}")
-        span.set_attribute("operation.type", "weather_inquiry")
-        span.set_attribute("location", "Seattle")
+        # Collected as they become known and set on the span in one call
+        span_attributes = {
+            "operation.type": "weather_inquiry",
+            "location": "Seattle",
+        }
         
         weather_response = client.chat.completions.create(
             model="gpt-4o",
             messages=[{"role": "user", "content": "What's the weather like in Seattle?"}],
         )
         
-        span.set_attribute("response.length", len(weather_response.choices[0].message.content))
+        span_attributes["response.length"] = len(weather_response.choices[0].message.content)
+        if span.is_recording():
+            span.set_attributes(span_attributes)
         print("\nWeather Response:")
         print(weather_response.choices[0].message.content)
 
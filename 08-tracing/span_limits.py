@@ -0,0 +1,42 @@
+"""
+Size limits for span attributes shared by the tracing samples.
+
+Import this module after OTEL_INSTRUMENTATION_GENAI_CAPTURE_MESSAGE_CONTENT
+is set and before telemetry is configured, so the SDK picks up the limits.
+"""
+
+import os
+
+TRUNC_SUFFIX = "...[truncated]"
+
+
+def _max_attribute_length() -> int:
+    """Get the attribute length cap from SPAN_ATTR_MAX, falling back to 512."""
+    try:
+        return max(0, int(os.environ.get("SPAN_ATTR_MAX", "512")))
+    except ValueError:
+        return 512
+
+
+# Cap the size of string span attributes. Full values are only kept when
+# message content capture is on and SPAN_ATTR_DEBUG=1 is set.
+MAX_ATTRIBUTE_LENGTH = _max_attribute_length()
+FULL_SPAN_ATTRIBUTES = (
+    os.environ.get("OTEL_INSTRUMENTATION_GENAI_CAPTURE_MESSAGE_CONTENT") == "true"
+    and os.environ.get("SPAN_ATTR_DEBUG") == "1"
+)
+if not FULL_SPAN_ATTRIBUTES:
+    # Let the SDK enforce the same limits on every span, including instrumented ones
+    os.environ.setdefault("OTEL_ATTRIBUTE_VALUE_LENGTH_LIMIT", str(MAX_ATTRIBUTE_LENGTH))
+    os.environ.setdefault("OTEL_ATTRIBUTE_COUNT_LIMIT", "32")
+
+
+def truncate_attribute(value: str) -> str:
+    """Shorten a string to MAX_ATTRIBUTE_LENGTH characters before recording it on a span."""
+    if FULL_SPAN_ATTRIBUTES or len(value) <= MAX_ATTRIBUTE_LENGTH:
+        return value
+    if MAX_ATTRIBUTE_LENGTH <= len(TRUNC_SUFFIX):
+        # Too small for the marker, so just cut the value
+        return value[:MAX_ATTRIBUTE_LENGTH]
+    # Keep the marked value within the cap so the SDK limit doesn't cut the marker off
+    return value[:MAX_ATTRIBUTE_LENGTH - len(TRUNC_SUFFIX)] + TRUNC_SUFFIX
@@ -13,6 +13,10 @@ import sys
 
 load_dotenv()
 
+# Fallback calculation, folded to a constant at compile time
+FALLBACK_CALCULATION = "100 + 200 - 50"
+FALLBACK_RESULT = 100 + 200 - 50
+
 async def fixed_mcp_example():
     """Fixed MCP example using direct Python execution."""
     print("🔧 Fixed MCP Client Example")
@@ -63,11 +67,8 @@ def simple_fallback_demo():
     print("=" * 50)
     
     # Simple calculation without MCP
-    calculation = "100 + 200 - 50"
-    result = eval(calculation)
-    
-    print(f"📊 Calculation: {calculation}")
-    print(f"🎯 Result: {result}")
+    print(f"📊 Calculation: {FALLBACK_CALCULATION}")
+    print(f"🎯 Result: {FALLBACK_RESULT}")
     print("✅ Fallback demo completed!")
 
 if __name__ == "__main__":
@@ -5,8 +5,6 @@ This doesn't use MCP but shows how to run Python files with functions.
 """
 import asyncio
 import os
-from typing import Annotated
-from pydantic import Field
 
 # Simple calculator functions (similar to what the MCP server provides)
 def add(a: int, b: int) -> int:
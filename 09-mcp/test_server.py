@@ -3,25 +3,79 @@
 Simple test script to verify stdio-server.py is working correctly.
 This bypasses the agent framework complexity.
 """
-import json
-import subprocess
+import asyncio
 import sys
+import time
 
-def test_mcp_server():
-    """Test the MCP server directly using subprocess."""
+import orjson
+
+# Maximum time to wait for a single JSON-RPC response line
+RESPONSE_TIMEOUT = 5.0
+
+# Longest JSON-RPC response line accepted from the server. asyncio's default
+# of 64 KiB is too small for larger tools/list payloads.
+MAX_LINE_LENGTH = 1024 * 1024
+
+
+async def send_message(server_process, message: dict):
+    """Write one newline-delimited JSON-RPC message to the server."""
+    server_process.stdin.write(orjson.dumps(message) + b"\n")
+    await server_process.stdin.drain()
+
+
+async def read_response(server_process, request_id: int) -> dict:
+    """Read lines from the server until the response for request_id arrives."""
+    while True:
+        line = await asyncio.wait_for(server_process.stdout.readline(), timeout=RESPONSE_TIMEOUT)
+        if not line:
+            raise ConnectionError("Server closed its stdout")
+        message = orjson.loads(line)
+        if message.get("id") == request_id:
+            return message
+
+
+async def send_request(server_process, request: dict) -> dict:
+    """Send a request and wait only as long as it takes for its response."""
+    print(f"📤 Sending: {request['method']}")
+    start = time.perf_counter()
+    await send_message(server_process, request)
+    response = await read_response(server_process, request["id"])
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"📥 Response ({elapsed_ms:.1f} ms): {response}")
+    return response
+
+
+async def print_server_stderr(stderr_task: asyncio.Task, return_code: int):
+    """Print whatever the server wrote to stderr, followed by its return code."""
+    stderr = await stderr_task
+    if stderr:
+        print(f"❌ Error: {stderr.decode(errors='replace')}")
+    print(f"🔄 Return code: {return_code}")
+
+
+async def stop_server(server_process, stderr_task: asyncio.Task):
+    """Kill the server if it is still running and report why it stopped."""
+    if server_process.returncode is None:
+        server_process.kill()
+    return_code = await server_process.wait()
+    await print_server_stderr(stderr_task, return_code)
+
+
+async def test_mcp_server():
+    """Test the MCP server directly using a single subprocess for all requests."""
     print("🧪 Testing MCP Server Directly...")
-    
+
     # Start the server process
-    server_process = subprocess.Popen(
-        [sys.executable, "stdio-server.py"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        cwd="."
+    server_process = await asyncio.create_subprocess_exec(
+        sys.executable, "stdio-server.py",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=".",
+        limit=MAX_LINE_LENGTH
     )
-    
-    # Send initialization request
+
+    # Initialization request
     init_request = {
         "jsonrpc": "2.0",
         "id": 1,
@@ -37,31 +91,43 @@ def test_mcp_server():
             }
         }
     }
-    
-    # Send the request
-    request_str = json.dumps(init_request) + "\n"
-    print(f"📤 Sending: {request_str.strip()}")
-    
+
+    # Requests sent over the same connection once initialized
+    tool_requests = [
+        {"jsonrpc": "2.0", "id": 2, "method": "tools/list", "params": {}},
+        {
+            "jsonrpc": "2.0",
+            "id": 3,
+            "method": "tools/call",
+            "params": {"name": "add", "arguments": {"a": 2, "b": 3}}
+        },
+    ]
+
+    # Read stderr in the background so a chatty server can't fill the pipe and stall
+    stderr_task = asyncio.create_task(server_process.stderr.read())
+
     try:
-        stdout, stderr = server_process.communicate(input=request_str, timeout=5)
-        print(f"📥 Response: {stdout}")
-        if stderr:
-            print(f"❌ Error: {stderr}")
-        
-        return_code = server_process.returncode
-        print(f"🔄 Return code: {return_code}")
-        
-        if return_code == 0:
+        responses = [await send_request(server_process, init_request)]
+        await send_message(server_process, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+        for request in tool_requests:
+            responses.append(await send_request(server_process, request))
+
+        # Closing stdin tells the stdio server to shut down
+        server_process.stdin.close()
+        return_code = await asyncio.wait_for(server_process.wait(), timeout=RESPONSE_TIMEOUT)
+        await print_server_stderr(stderr_task, return_code)
+
+        if return_code == 0 and not any("error" in response for response in responses):
             print("✅ Server is working correctly!")
         else:
             print("❌ Server failed")
-            
-    except subprocess.TimeoutExpired:
+
+    except asyncio.TimeoutError:
         print("⏰ Server test timed out")
-        server_process.kill()
+        await stop_server(server_process, stderr_task)
     except Exception as e:
         print(f"❌ Error testing server: {e}")
-        server_process.kill()
+        await stop_server(server_process, stderr_task)
 
 if __name__ == "__main__":
-    test_mcp_server()
\ No newline at end of file
+    asyncio.run(test_mcp_server())